@@ -1,23 +1,35 @@
 # main.py
 import os
-import json
-import re
+import time
+import secrets
+import asyncio
+import logging
+from collections import OrderedDict
 from typing import Optional, List, Dict, Any
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
 import httpx
+import orjson
 from datetime import datetime
 from dotenv import load_dotenv
 
+from matcher import MATCH_THRESHOLD, SUGGEST_COUNT, tokenize, build_faq_index, simple_match
+
 load_dotenv()  # charge .env local
 
+logger = logging.getLogger(__name__)
+
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise RuntimeError("Supabase config missing in .env")
 
+# secret partagé des routes d'admin (en-tête X-Admin-Token) ; sans lui elles sont désactivées
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 FAQ_ENDPOINT = f"{SUPABASE_URL}/rest/v1/faq"
 CONV_ENDPOINT = f"{SUPABASE_URL}/rest/v1/conversations"
 
@@ -25,110 +37,244 @@ SUPABASE_HEADERS = {
     "apikey": SUPABASE_KEY,
     "Authorization": f"Bearer {SUPABASE_KEY}",
     "Content-Type": "application/json",
-    "Accept": "application/json"
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip"
 }
 
-app = FastAPI(title="Wozo Chatbot API")
+# seules les colonnes utilisées par le matching, la réponse et le rechargement incrémental
+FAQ_COLUMNS = "id,question_examples,tags,intent,answer,updated_at"
+
+app = FastAPI(title="Wozo Chatbot API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://localhost:3000"],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # uniquement ce que le front utilise ; preflight mis en cache 24h par le navigateur
+    allow_methods=["POST", "OPTIONS"],
+    allow_headers=["Content-Type"],
+    max_age=86400,
 )
 
+MAX_MESSAGE_LENGTH = 2048  # caractères, borne le travail de tokenize/matching
+
 class MessageIn(BaseModel):
+    # validation faite par pydantic-core (Rust), espaces retirés au passage
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     user_id: Optional[str] = None
     message: str
 
 # ======================================================
-#  NOUVEAU MOTEUR DE MATCHING AMÉLIORÉ
+#  SUPABASE
 # ======================================================
 
-MATCH_THRESHOLD = 2        # plus haut = plus strict
-SUGGEST_COUNT = 3          # nombre de suggestions à proposer
-
-def tokenize(text: str) -> List[str]:
-    text = (text or "").lower()
-    text = re.sub(r"[^\w\sàâéèêîôûçëüï'-]", " ", text)
-    return [t for t in text.split() if len(t) > 1]
-
-def score_row_by_overlap(query_tokens: List[str], row: Dict[str, Any]) -> float:
-    text = ""
-    if row.get("question_examples"):
-        text += " ".join(row["question_examples"]) + " "
-    if row.get("tags"):
-        text += " ".join(row["tags"]) + " "
-    if row.get("intent"):
-        text += row["intent"]
-
-    tokens = tokenize(text)
-    score = 0.0
-
-    for t in query_tokens:
-        if t in tokens:
-            score += 1.0
-        else:
-            # matching approximate subtokens
-            for tk in tokens:
-                if t in tk or tk in t:
-                    score += 0.5
-                    break
-    return score
-
-def simple_match(query: str, faq_rows: List[Dict[str, Any]]):
-    qtokens = tokenize(query)
-    best = {"score": 0.0, "row": None}
-    scored = []
-
-    for row in faq_rows:
-        s = score_row_by_overlap(qtokens, row)
-        scored.append((s, row))
-        if s > best["score"]:
-            best = {"score": s, "row": row}
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return best, scored
+@app.on_event("startup")
+async def startup():
+    # un seul client HTTP partagé : connexions réutilisées (pas de TLS à chaque requête)
+    app.state.http = httpx.AsyncClient(
+        timeout=10.0,
+        http2=True,
+        headers=SUPABASE_HEADERS,
+        limits=httpx.Limits(max_connections=120, max_keepalive_connections=80, keepalive_expiry=30),
+    )
+    # file des conversations à enregistrer, vidée par lots par un seul worker
+    app.state.conv_q = asyncio.Queue(maxsize=CONV_QUEUE_SIZE)
+    app.state.conv_dropped = 0
+    app.state.conv_worker = asyncio.create_task(_conv_worker(app.state.conv_q))
 
-# ======================================================
-#  SUPABASE
-# ======================================================
+    # FAQ chargée avant la première requête puis rafraîchie en tâche de fond
+    try:
+        await refresh_faq()
+    except Exception as e:
+        logger.warning("Initial FAQ load failed, retrying on first message: %r", e)
+    app.state.faq_refresher = asyncio.create_task(_faq_refresher())
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.faq_refresher.cancel()
+    # None = fin de file : le worker envoie ce qui reste puis s'arrête
+    await app.state.conv_q.put(None)
+    await app.state.conv_worker
+    await app.state.http.aclose()
+
+async def fetch_faq(since: Optional[str] = None):
+    params = {"select": FAQ_COLUMNS, "order": "updated_at.asc.nullsfirst"}
+    if since:
+        # seulement les lignes modifiées depuis le dernier chargement
+        params["updated_at"] = f"gte.{since}"
+    resp = await app.state.http.get(
+        FAQ_ENDPOINT,
+        params=params,
+        headers={"Prefer": "count=none"},
+    )
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+FAQ_REFRESH_INTERVAL = 60.0  # secondes entre deux rafraîchissements de la FAQ
+FAQ_FULL_REFRESH = 600.0   # secondes entre deux rechargements complets (lignes supprimées)
+
+_faq_cache = {
+    "rows": None,
+    "index": None,
+    "full_expires": 0.0,
+    "max_updated_at": None,
+    "version": 0,
+    "loading": None,   # chargement à froid en cours, partagé par les requêtes
+}
+_faq_lock = asyncio.Lock()
 
-async def fetch_faq():
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        resp = await client.get(FAQ_ENDPOINT, headers=SUPABASE_HEADERS, params={"select": "*"})
-        resp.raise_for_status()
-        return resp.json()
+def merge_faq_rows(rows: List[Dict[str, Any]], delta: List[Dict[str, Any]]):
+    """Applique les lignes modifiées (par id) sur la FAQ en mémoire.
+    Renvoie la nouvelle liste et si quelque chose a changé."""
+    positions = {row.get("id"): i for i, row in enumerate(rows)}
+    merged = list(rows)
+    changed = False
+    for row in delta:
+        i = positions.get(row.get("id"))
+        if i is None:
+            positions[row.get("id")] = len(merged)
+            merged.append(row)
+            changed = True
+        elif merged[i] != row:
+            merged[i] = row
+            changed = True
+    return merged, changed
 
-async def insert_conversation(user_id: Optional[str], messages: List[Dict[str, Any]]):
+async def refresh_faq(full: bool = False):
+    # une seule mise à jour à la fois (tâche de fond, démarrage à froid, invalidation)
+    async with _faq_lock:
+        await _refresh_faq(full=full)
+
+async def _refresh_faq(full: bool = False):
+    # full=True force le rechargement complet ; décidé sous le verrou, jamais via
+    # full_expires qu'un rechargement déjà en cours réécrirait en se terminant
+    now = time.monotonic()
+    if full or _faq_cache["rows"] is None or now >= _faq_cache["full_expires"]:
+        delta = faq_rows = await fetch_faq()
+        changed = True
+        _faq_cache["full_expires"] = now + FAQ_FULL_REFRESH
+    else:
+        delta = await fetch_faq(since=_faq_cache["max_updated_at"])
+        faq_rows, changed = merge_faq_rows(_faq_cache["rows"], delta)
+
+    # lignes triées par updated_at : la dernière datée est la plus récente
+    for row in reversed(delta):
+        if row.get("updated_at"):
+            _faq_cache["max_updated_at"] = row["updated_at"]
+            break
+
+    if changed:
+        _faq_cache["rows"] = faq_rows
+        _faq_cache["index"] = build_faq_index(faq_rows)
+        _faq_cache["version"] += 1
+
+async def _faq_refresher():
+    while True:
+        await asyncio.sleep(FAQ_REFRESH_INTERVAL)
+        try:
+            await refresh_faq()
+        except Exception as e:
+            logger.warning("FAQ refresh failed, keeping current snapshot: %r", e)
+
+async def get_faq_cached():
+    # les requêtes lisent la dernière version chargée, sans attendre de rechargement ;
+    # seul un démarrage sans FAQ (chargement initial raté) force un chargement ici,
+    # une seule tentative à la fois : toutes les requêtes en attente en partagent
+    # le résultat, y compris l'échec (sinon chacune refait la requête à son tour)
+    if _faq_cache["rows"] is None:
+        load = _faq_cache["loading"]
+        if load is None or load.done():
+            load = _faq_cache["loading"] = asyncio.create_task(refresh_faq())
+        # shield : une requête annulée n'annule pas le chargement des autres
+        await asyncio.shield(load)
+    return _faq_cache["rows"], _faq_cache["index"]
+
+async def invalidate_faq_cache():
+    # rechargement complet immédiat (voit aussi les lignes supprimées)
+    await refresh_faq(full=True)
+
+CONV_QUEUE_SIZE = 10000    # conversations en attente avant d'en perdre
+CONV_BATCH_SIZE = 50       # conversations max par POST
+CONV_BATCH_DELAY = 0.05    # secondes max d'attente pour compléter un lot
+
+def insert_conversation(user_id: Optional[str], messages: List[Dict[str, Any]]):
     payload = {
         "user_id": user_id,
         "messages": messages,
         "metadata": {}
     }
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        resp = await client.post(CONV_ENDPOINT, headers=SUPABASE_HEADERS, json=payload)
-        resp.raise_for_status()
-        return resp.json()
+    try:
+        app.state.conv_q.put_nowait(payload)
+    except asyncio.QueueFull:
+        app.state.conv_dropped += 1
+        logger.warning("Conversation queue full, %d conversations dropped so far", app.state.conv_dropped)
+
+async def insert_conversations(payloads: List[Dict[str, Any]]):
+    # PostgREST insère directement une liste de lignes
+    resp = await app.state.http.post(
+        CONV_ENDPOINT,
+        content=orjson.dumps(payloads),
+        headers={"Prefer": "return=minimal"},  # pas besoin des lignes insérées en retour
+    )
+    resp.raise_for_status()
+
+async def flush_conversations(batch: List[Dict[str, Any]]):
+    try:
+        await insert_conversations(batch)
+        return
+    except httpx.HTTPStatusError as e:
+        # un lot est une seule requête SQL : une ligne invalide (user_id...) fait tout
+        # rejeter. Sur une 4xx on renvoie ligne par ligne pour ne perdre que celle-là
+        if not (400 <= e.response.status_code < 500 and len(batch) > 1):
+            logger.warning("Conversation insert failed (%d rows): %r", len(batch), e)
+            return
+    except Exception as e:
+        logger.warning("Conversation insert failed (%d rows): %r", len(batch), e)
+        return
+
+    for payload in batch:
+        try:
+            await insert_conversations([payload])
+        except Exception as e:
+            logger.warning("Conversation insert failed (user_id=%r): %r", payload["user_id"], e)
+
+async def _conv_worker(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    stopping = False
+
+    while not stopping:
+        first = await queue.get()
+        if first is None:
+            break
+        batch = [first]
+        deadline = loop.time() + CONV_BATCH_DELAY
+
+        while len(batch) < CONV_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+
+        await flush_conversations(batch)
 
 # ======================================================
 #  ROUTE PRINCIPALE /api/message
 # ======================================================
 
-@app.post("/api/message")
-async def handle_message(payload: MessageIn):
-    if not payload.message or not payload.message.strip():
-        raise HTTPException(status_code=400, detail="Empty message")
-
-    message_text = payload.message.strip()
+ANSWER_CACHE_SIZE = 1024   # réponses mémorisées (messages fréquents : "bonjour"...)
 
-    try:
-        faq_rows = await fetch_faq()
-    except Exception as e:
-        raise HTTPException(status_code=502, detail="Error fetching FAQ data")
+_answer_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
 
-    best, ranked = simple_match(message_text, faq_rows)
+def build_answer(message_text: str, index: Dict[str, Any]) -> Dict[str, Any]:
+    best, ranked = simple_match(message_text, index)
     match_score = best["score"] or 0.0
 
     # ----- Bonne correspondance
@@ -159,16 +305,63 @@ async def handle_message(payload: MessageIn):
             "match_score": match_score
         }
 
+    return response_payload
+
+def get_answer(message_text: str, index: Dict[str, Any]) -> Dict[str, Any]:
+    # la réponse ne dépend que des tokens du message : même clé pour "Bonjour!" et "BONJOUR",
+    # préfixée par la version de la FAQ pour ignorer les réponses d'avant un rechargement
+    key = f"{_faq_cache['version']}:" + " ".join(sorted(tokenize(message_text)))
+    response_payload = _answer_cache.get(key)
+    if response_payload is not None:
+        _answer_cache.move_to_end(key)
+        return response_payload
+
+    response_payload = build_answer(message_text, index)
+    _answer_cache[key] = response_payload
+    if len(_answer_cache) > ANSWER_CACHE_SIZE:
+        _answer_cache.popitem(last=False)
+    return response_payload
+
+@app.post("/api/message")
+async def handle_message(payload: MessageIn):
+    if not payload.message:
+        raise HTTPException(status_code=400, detail="Empty message")
+
+    message_text = payload.message
+    if len(message_text) > MAX_MESSAGE_LENGTH:
+        raise HTTPException(status_code=413, detail="Message too long")
+
+    try:
+        faq_rows, index = await get_faq_cached()
+    except Exception as e:
+        raise HTTPException(status_code=502, detail="Error fetching FAQ data")
+
+    response_payload = get_answer(message_text, index)
+
     # ----- Log dans Supabase
-    now_iso = datetime.utcnow().isoformat() + "Z"
+    now_iso = datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
     messages = [
         {"from": "user", "text": message_text, "timestamp": now_iso},
-        {"from": "bot", "text": response_payload["answer"], "timestamp": datetime.utcnow().isoformat() + "Z"}
+        {"from": "bot", "text": response_payload["answer"], "timestamp": now_iso}
     ]
 
-    try:
-        await insert_conversation(payload.user_id, messages)
-    except Exception:
-        pass  # on ignore l'erreur mais le bot répond quand même
+    # mis en file : le bot répond sans attendre l'écriture dans Supabase
+    insert_conversation(payload.user_id, messages)
 
     return response_payload
+
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints disabled")
+    if not token or not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/api/faq/invalidate")
+async def invalidate_faq(x_admin_token: Optional[str] = Header(None)):
+    # à appeler après une modification de la table faq
+    require_admin(x_admin_token)
+    try:
+        await invalidate_faq_cache()
+    except Exception:
+        raise HTTPException(status_code=502, detail="Error fetching FAQ data")
+    return {"invalidated": True}
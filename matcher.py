@@ -0,0 +1,205 @@
+# matcher.py
+import re
+import heapq
+from collections import Counter
+from typing import List, Dict, Any, Union
+import numpy as np
+from scipy.sparse import csr_matrix
+
+__all__ = [
+    "MATCH_THRESHOLD",
+    "STRONG_THRESHOLD",
+    "SUGGEST_COUNT",
+    "NGRAM_SIZE",
+    "SMALL_FAQ_ROWS",
+    "tokenize",
+    "row_tokens",
+    "build_faq_index",
+    "fuzzy_rows",
+    "exact_scores",
+    "add_fuzzy_scores",
+    "simple_match",
+]
+
+# ======================================================
+#  NOUVEAU MOTEUR DE MATCHING AMÉLIORÉ
+# ======================================================
+
+MATCH_THRESHOLD = 2        # plus haut = plus strict
+STRONG_THRESHOLD = 4       # score exact à partir duquel on arrête de chercher
+SUGGEST_COUNT = 3          # nombre de suggestions à proposer
+NGRAM_SIZE = 3             # taille des n-grammes de l'index approximatif
+SMALL_FAQ_ROWS = 200       # en dessous, scoring en Python pur (plus rapide que numpy)
+
+Scores = Union[List[float], np.ndarray]
+
+_CLEAN_RE = re.compile(r"[^\w\sàâéèêîôûçëüï'-]")
+# même filtre que _CLEAN_RE pour les textes ASCII, appliqué par bytes.translate
+_ASCII_TABLE = bytes(0x20 if _CLEAN_RE.match(chr(c)) else c for c in range(128)) + bytes(range(128, 256))
+
+def tokenize(text: str) -> List[str]:
+    text = (text or "").lower()
+    if text.isascii():
+        text = text.encode("ascii").translate(_ASCII_TABLE).decode("ascii")
+    else:
+        text = _CLEAN_RE.sub(" ", text)
+    return [t for t in text.split() if len(t) > 1]
+
+def row_tokens(row: Dict[str, Any]) -> List[str]:
+    text = ""
+    if row.get("question_examples"):
+        text += " ".join(row["question_examples"]) + " "
+    if row.get("tags"):
+        text += " ".join(row["tags"]) + " "
+    if row.get("intent"):
+        text += row["intent"]
+    return tokenize(text)
+
+def ngrams(token: str, n: int) -> List[str]:
+    return [token[i:i + n] for i in range(len(token) - n + 1)]
+
+def build_faq_index(faq_rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # tokens de chaque ligne, calculés une seule fois par chargement de la FAQ,
+    # + pour les grosses FAQ, matrice lignes x vocabulaire (1 si le token est dans la ligne)
+    # + index inversé token -> lignes et n-grammes (2 et 3 lettres) -> lignes
+    entries = []
+    vocab: Dict[str, int] = {}
+    indices: List[int] = []
+    indptr = [0]
+    token_rows: Dict[str, set] = {}
+    gram_rows: Dict[str, set] = {}
+    max_len = 0
+
+    for row_id, row in enumerate(faq_rows):
+        tokens_list = list(dict.fromkeys(row_tokens(row)))
+        entries.append({"id": row_id, "tokens_list": tokens_list, "row": row})
+        for tk in tokens_list:
+            indices.append(vocab.setdefault(tk, len(vocab)))
+            token_rows.setdefault(tk, set()).add(row_id)
+            max_len = max(max_len, len(tk))
+            for n in (2, NGRAM_SIZE):
+                for gram in ngrams(tk, n):
+                    gram_rows.setdefault(gram, set()).add(row_id)
+        indptr.append(len(indices))
+
+    if len(entries) < SMALL_FAQ_ROWS:
+        score_exact = _postings_scorer(token_rows, len(entries))
+    else:
+        matrix = csr_matrix(
+            (np.ones(len(indices)), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int32)),
+            shape=(len(entries), len(vocab)),
+        )
+        score_exact = _matrix_scorer(matrix, vocab)
+
+    return {
+        "entries": entries,
+        "score_exact": score_exact,
+        "token_rows": token_rows,
+        "gram_rows": gram_rows,
+        "max_len": max_len,
+    }
+
+def fuzzy_rows(token: str, index: Dict[str, Any]) -> set:
+    """Lignes où `token` n'est pas présent tel quel mais où un token
+    de la ligne le contient ou est contenu dedans."""
+    token_rows = index["token_rows"]
+    gram_rows = index["gram_rows"]
+
+    # token contenu dans un token de la ligne : la ligne a tous ses n-grammes
+    postings = [gram_rows.get(g) for g in set(ngrams(token, min(len(token), NGRAM_SIZE)))]
+    hits = set()
+    if postings and all(postings):
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        entries = index["entries"]
+        hits = {r for r in candidates if any(token in tk for tk in entries[r]["tokens_list"])}
+
+    # token de la ligne contenu dans le token : on cherche ses sous-chaînes
+    for size in range(2, min(len(token) - 1, index["max_len"]) + 1):
+        for sub in ngrams(token, size):
+            rows = token_rows.get(sub)
+            if rows:
+                hits |= rows
+
+    exact = token_rows.get(token)
+    return hits - exact if exact else hits
+
+# La FAQ ne change pas entre deux rechargements : le scorer exact est
+# spécialisé une fois pour l'index (tables et tailles liées dans la closure)
+
+def _postings_scorer(token_rows: Dict[str, set], row_count: int):
+    # petite FAQ : on suit directement l'index inversé token -> lignes
+    postings = {tk: tuple(sorted(rows)) for tk, rows in token_rows.items()}.get
+
+    def score(query_tokens: List[str]) -> List[float]:
+        scores = [0.0] * row_count
+        for t in query_tokens:
+            for r in postings(t, ()):
+                scores[r] += 1.0
+        return scores
+    return score
+
+def _matrix_scorer(matrix: csr_matrix, vocab: Dict[str, int]):
+    # grosse FAQ : un seul produit matrice creuse x vecteur
+    col_of = vocab.get
+    size = len(vocab)
+
+    def score(query_tokens: List[str]) -> np.ndarray:
+        q = np.zeros(size)
+        for t in query_tokens:
+            col = col_of(t)
+            if col is not None:
+                q[col] += 1.0
+        return matrix @ q
+    return score
+
+def exact_scores(query_tokens: List[str], index: Dict[str, Any]) -> Scores:
+    return index["score_exact"](query_tokens)
+
+def add_fuzzy_scores(scores: Scores, query_tokens: List[str], index: Dict[str, Any]):
+    # matching approximate subtokens
+    for t, count in Counter(query_tokens).items():
+        rows = fuzzy_rows(t, index)
+        if not rows:
+            continue
+        if isinstance(scores, np.ndarray):
+            scores[list(rows)] += 0.5 * count
+        else:
+            for r in rows:
+                scores[r] += 0.5 * count
+
+def _argmax(scores: Scores) -> int:
+    if isinstance(scores, np.ndarray):
+        return int(scores.argmax())
+    return scores.index(max(scores))
+
+def _top_rows(scores: Scores, count: int) -> List[int]:
+    # ordre décroissant, à score égal la première ligne d'abord
+    if isinstance(scores, np.ndarray):
+        return np.argsort(-scores, kind="stable")[:count].tolist()
+    return heapq.nlargest(count, range(len(scores)), key=scores.__getitem__)
+
+def simple_match(query: str, index: Dict[str, Any]):
+    qtokens = tokenize(query)
+    entries = index["entries"]
+    best = {"score": 0.0, "row": None}
+    if not entries:
+        return best, []
+    if not qtokens:
+        # rien à scorer : toutes les lignes à 0, suggestions = premières lignes
+        return best, [(0.0, e["row"]) for e in entries[:SUGGEST_COUNT]]
+
+    scores = exact_scores(qtokens, index)
+    top = _argmax(scores)
+    # correspondance exacte déjà nette : inutile de chercher les approximatives
+    if scores[top] < STRONG_THRESHOLD:
+        add_fuzzy_scores(scores, qtokens, index)
+        top = _argmax(scores)
+
+    if scores[top] > 0:
+        best = {"score": float(scores[top]), "row": entries[top]["row"]}
+    if best["score"] >= MATCH_THRESHOLD:
+        return best, []
+
+    # classement seulement quand il faut proposer des suggestions
+    return best, [(float(scores[r]), entries[r]["row"]) for r in _top_rows(scores, SUGGEST_COUNT)]
@@ -0,0 +1,177 @@
+# test_matcher.py
+import random
+import re
+
+import numpy as np
+import pytest
+
+import matcher
+from matcher import (
+    MATCH_THRESHOLD, STRONG_THRESHOLD, SUGGEST_COUNT, SMALL_FAQ_ROWS,
+    build_faq_index, exact_scores, simple_match, tokenize,
+)
+
+# ------------------------------------------------------
+#  Moteur de référence : le matching d'origine, sans index
+# ------------------------------------------------------
+
+def ref_tokenize(text):
+    text = (text or "").lower()
+    text = re.sub(r"[^\w\sàâéèêîôûçëüï'-]", " ", text)
+    return [t for t in text.split() if len(t) > 1]
+
+def ref_score_row(query_tokens, row):
+    text = ""
+    if row.get("question_examples"):
+        text += " ".join(row["question_examples"]) + " "
+    if row.get("tags"):
+        text += " ".join(row["tags"]) + " "
+    if row.get("intent"):
+        text += row["intent"]
+
+    tokens = ref_tokenize(text)
+    score = 0.0
+    for t in query_tokens:
+        if t in tokens:
+            score += 1.0
+        else:
+            for tk in tokens:
+                if t in tk or tk in t:
+                    score += 0.5
+                    break
+    return score
+
+def ref_simple_match(query, faq_rows):
+    qtokens = ref_tokenize(query)
+    best = {"score": 0.0, "row": None}
+    scored = []
+    for row in faq_rows:
+        s = ref_score_row(qtokens, row)
+        scored.append((s, row))
+        if s > best["score"]:
+            best = {"score": s, "row": row}
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return best, scored
+
+# ------------------------------------------------------
+#  Données aléatoires
+# ------------------------------------------------------
+
+WORDS = (
+    "prix tarif tarifs horaire horaires ouverture contact contacter email téléphone "
+    "combien coûte quels sont vos comment livraison délai commande annuler remboursement "
+    "compte mot passe oublié ça l'adresse e-mail 12 123 x_y œuvre ñandú ab abc"
+).split()
+
+def random_sentence(rng, n):
+    return " ".join(rng.choice(WORDS) + rng.choice(["", "", "!", "?", ",", "s"]) for _ in range(n))
+
+def random_faq(rng, count):
+    return [
+        {
+            "id": i,
+            "intent": rng.choice(WORDS + [None]),
+            "tags": [rng.choice(WORDS) for _ in range(rng.randint(0, 3))] or None,
+            "question_examples": [random_sentence(rng, rng.randint(1, 6)) for _ in range(rng.randint(0, 3))],
+            "answer": f"réponse {i}",
+        }
+        for i in range(count)
+    ]
+
+def ids(scored):
+    return [(s, row["id"]) for s, row in scored]
+
+# ------------------------------------------------------
+#  Tests
+# ------------------------------------------------------
+
+@pytest.mark.parametrize("row_count", [0, 1, 5, 40, SMALL_FAQ_ROWS - 1, SMALL_FAQ_ROWS, 300])
+def test_simple_match_agrees_with_reference(row_count):
+    rng = random.Random(row_count)
+    rows = random_faq(rng, row_count)
+    index = build_faq_index(rows)
+
+    for _ in range(500):
+        query = random_sentence(rng, rng.randint(0, 8))
+        ref_best, ref_ranked = ref_simple_match(query, rows)
+        best, ranked = simple_match(query, index)
+
+        if ref_best["score"] >= STRONG_THRESHOLD:
+            # arrêt anticipé : n'importe quelle ligne assez forte est acceptée
+            assert best["score"] >= STRONG_THRESHOLD
+            assert ranked == []
+            continue
+
+        assert best["score"] == ref_best["score"]
+        assert best["row"] is ref_best["row"]
+        if best["score"] >= MATCH_THRESHOLD:
+            assert ranked == []
+        else:
+            assert ids(ranked) == ids(ref_ranked[:SUGGEST_COUNT])
+
+@pytest.mark.parametrize("row_count, score_type", [(SMALL_FAQ_ROWS - 1, list), (SMALL_FAQ_ROWS, np.ndarray)])
+def test_scorer_path_depends_on_faq_size(row_count, score_type):
+    rows = random_faq(random.Random(0), row_count)
+    index = build_faq_index(rows)
+    qtokens = tokenize("quels sont vos tarifs")
+
+    scores = exact_scores(qtokens, index)
+    assert isinstance(scores, score_type)
+    expected = [sum(1.0 for t in qtokens if t in set(ref_tokenize(
+        " ".join((r["question_examples"] or []) + (r["tags"] or []) + [r["intent"] or ""])
+    ))) for r in rows]
+    assert list(scores) == expected
+
+@pytest.mark.parametrize("row_count", [SMALL_FAQ_ROWS - 1, SMALL_FAQ_ROWS])
+def test_suggestions_keep_row_order_on_ties(row_count):
+    rows = [
+        {"id": i, "intent": f"intent{i}", "tags": ["livraison"] if i % 7 == 3 else None,
+         "question_examples": [f"question {i}"], "answer": "x"}
+        for i in range(row_count)
+    ]
+    index = build_faq_index(rows)
+
+    # même score partout (0) : les premières lignes
+    best, ranked = simple_match("zzz", index)
+    assert best["row"] is None
+    assert [row["id"] for _, row in ranked] == [0, 1, 2]
+
+    # égalité sur les lignes taguées : première ligne taguée gagnante, suggestions dans l'ordre
+    best, ranked = simple_match("livraison", index)
+    assert best["row"]["id"] == 3
+    assert [row["id"] for _, row in ranked] == [3, 10, 17]
+
+def test_two_letter_query_tokens():
+    rows = [
+        {"id": 0, "intent": "ça", "tags": None, "question_examples": None, "answer": "a"},
+        {"id": 1, "intent": "abc", "tags": None, "question_examples": None, "answer": "b"},
+        {"id": 2, "intent": "ab", "tags": None, "question_examples": None, "answer": "c"},
+        {"id": 3, "intent": "xyz", "tags": None, "question_examples": None, "answer": "d"},
+    ]
+    index = build_faq_index(rows)
+
+    # exact sur "ça", approximatif "ab" ⊂ "abc", exact sur "ab"
+    scores = list(exact_scores(["ça", "ab"], index))
+    assert scores == [1.0, 0.0, 1.0, 0.0]
+    for query in ("ça", "ab", "ça ab", "bc", "xaby"):
+        assert ids(simple_match(query, index)[1]) == ids(ref_simple_match(query, rows)[1][:SUGGEST_COUNT])
+
+@pytest.mark.parametrize("text", [
+    "Quels sont vos TARIFS ?!",
+    "prix: 12€ / mois (x_y) l'offre e-mail",
+    "Ça coûte combien ? 😀 l'été-2024",
+    "œuvre ñandú — «test» 価格",
+    "",
+    None,
+])
+def test_tokenize_ascii_and_non_ascii(text):
+    assert tokenize(text) == ref_tokenize(text)
+
+def test_tokenize_ascii_table_matches_regex():
+    for c in range(128):
+        ch = chr(c)
+        assert ch.encode("ascii").translate(matcher._ASCII_TABLE).decode("ascii") == matcher._CLEAN_RE.sub(" ", ch)
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = "".join(chr(rng.randint(0, 127)) for _ in range(rng.randint(0, 30)))
+        assert tokenize(text) == ref_tokenize(text)